@@ -15,12 +15,19 @@ Edit PATHS below if your project root is different.
 """
 import os
 import json
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import rasterio
 from rasterio.features import shapes, rasterize
+from rasterio.transform import array_bounds
+from rasterio.windows import Window
+from rasterio.enums import Resampling, MergeAlg
 import geopandas as gpd
 from shapely.geometry import shape
-from skimage.morphology import remove_small_objects, closing, disk
+import cv2
+from numba import njit, prange
 import matplotlib.pyplot as plt
 import warnings
 warnings.simplefilter("ignore")
@@ -39,6 +46,8 @@ PREVIEW_PNG = os.path.join(PROJECT, "outputs", "maps", "training_polygons_previe
 
 # Processing params (tweak if needed)
 MIN_AREA_M2 = 2000        # minimum polygon area to keep (meters^2). reduce if CRS is degrees.
+RELAXED_MIN_AREA_M2 = 200 # fallback area threshold if nothing survives MIN_AREA_M2
+MIN_TILE_ROWS = 256       # striped TIFFs are read in full-width bands of at least this many rows
 SMALL_OBJ_PIXELS = 50     # remove small objects (in pixel units)
 MORPH_RADIUS = 3          # morphological closing radius (pixels)
 NDVI_VEG_TH = 0.30        # NDVI threshold for vegetation
@@ -46,212 +55,314 @@ NDVI_BARE_TH = 0.12       # NDVI below this often bare
 NDBI_URBAN_TH = 0.08      # NDBI threshold for urban (tune)
 WATER_NDWI_TH = 0.1       # NDWI > this likely water
 WATER_NDBI_TH = -0.15     # require low NDBI for water
-
-# ---------------------------
-# Ensure folders exist
-# ---------------------------
-for p in [os.path.join(PROJECT, "data", "training"), os.path.join(PROJECT, "outputs", "maps")]:
-    os.makedirs(p, exist_ok=True)
+AREA_CRS = "EPSG:6933"    # equal-area CRS used to measure polygon areas in m^2
 
 # ---------------------------
 # Helper functions
 # ---------------------------
-def autoscale(band):
-    """If band values are in 0..10000 scale, convert to 0..1"""
-    band = band.astype('float32')
-    mx = np.nanmax(band)
+def autoscale(band, mx):
+    """If band values are in 0..10000 scale (band maximum mx > 2), convert to 0..1 in place.
+    band must be float32; mx is the whole band's maximum so all tiles of a band scale alike."""
     if mx > 2:
-        return band / 10000.0
+        np.divide(band, np.float32(10000.0), out=band)
     return band
 
+# fastmath without 'nnan'/'ninf', so the isfinite checks (float rasters) are not optimized away,
+# and without 'reassoc'/'arcp', which would change the rounding of the index divisions
+FASTMATH = {'nsz', 'contract', 'afn'}
+
+# SCL code -> forced class, one lookup per pixel instead of several comparisons.
+# SCL codes common mapping: 6=water, 4=vegetation, 5=not-vegetated; 3,8,9,10 = cloud-shadow and cloud
+SCL_CLOUD = 255
+SCL_LUT = np.zeros(256, dtype='uint8')
+SCL_LUT[6] = 1
+SCL_LUT[4] = 3
+SCL_LUT[5] = 4
+SCL_LUT[[3, 8, 9, 10]] = SCL_CLOUD
+
+@njit(inline='always', cache=True)
+def classify_pixel(b2, b3, b4, b8, b11, scl_cls, nodata, check_finite):
+    """Class for one pixel with priority water(1) > urban(2) > veg(3) > bare(4), 0 = none.
+    scl_cls is SCL_LUT[scl], or 0 when the raster has no SCL band. nodata holds the nodata
+    value scaled like B2,B3,B4; check_finite is only needed for float rasters (ints cannot hold NaN)."""
+    if scl_cls == SCL_CLOUD:
+        return 0
+    # valid pixel (avoid nodata / nans)
+    valid = b2 != nodata[0] or b3 != nodata[1] or b4 != nodata[2]
+    if check_finite and valid:
+        valid = np.isfinite(b2) and np.isfinite(b3) and np.isfinite(b4) and np.isfinite(b8)
+    # SCL_LUT values are class ids, so without usable bands the SCL class (or 0) is the answer
+    if not valid:
+        return scl_cls
+    if scl_cls == 1:
+        return 1
+    # indices complement SCL; each is computed only once the ladder needs it.
+    # All arithmetic and comparisons stay float32, like the numpy float32 arrays they replace.
+    eps = np.float32(1e-8)
+    ndbi = (b11 - b8) / (b11 + b8 + eps)
+    ndwi = (b3 - b8) / (b3 + b8 + eps)
+    if ndwi > np.float32(WATER_NDWI_TH) and ndbi < np.float32(WATER_NDBI_TH):
+        return 1
+    ndvi = (b8 - b4) / (b8 + b4 + eps)
+    if ndbi > np.float32(NDBI_URBAN_TH) and ndvi < np.float32(0.25):
+        return 2
+    if scl_cls == 3 or ndvi >= np.float32(NDVI_VEG_TH):
+        return 3
+    if scl_cls == 4 or ndvi < np.float32(NDVI_BARE_TH):
+        return 4
+    return 0
+
+@njit(parallel=True, fastmath=FASTMATH, boundscheck=False, cache=True)
+def label_tile(b2, b3, b4, b8, b11, nodata, check_finite, out):
+    """Fused indices + thresholds + priority for a tile without SCL, written into out (uint8)"""
+    for i in prange(out.shape[0]):
+        for j in range(out.shape[1]):
+            out[i, j] = classify_pixel(b2[i, j], b3[i, j], b4[i, j], b8[i, j], b11[i, j], 0,
+                                       nodata, check_finite)
+
+@njit(parallel=True, fastmath=FASTMATH, boundscheck=False, cache=True)
+def label_tile_scl(b2, b3, b4, b8, b11, scl, nodata, check_finite, out):
+    """Same as label_tile, with the SCL band driving water/veg/bare and cloud removal"""
+    for i in prange(out.shape[0]):
+        for j in range(out.shape[1]):
+            out[i, j] = classify_pixel(b2[i, j], b3[i, j], b4[i, j], b8[i, j], b11[i, j], SCL_LUT[scl[i, j]],
+                                       nodata, check_finite)
+
+@lru_cache(maxsize=None)
+def structuring_element(radius):
+    """Disk closing kernel (same footprint as skimage disk(radius)), built once per radius and reused"""
+    y, x = np.ogrid[-radius:radius+1, -radius:radius+1]
+    return (x*x + y*y <= radius*radius).astype(np.uint8)
+
 def clean_bool(arr_bool, morph_radius=MORPH_RADIUS, min_size=SMALL_OBJ_PIXELS):
     """Apply closing + remove small speckles"""
     if not np.any(arr_bool):
         return arr_bool
-    arrc = closing(arr_bool, disk(morph_radius))
-    arrc = remove_small_objects(arrc.astype(bool), min_size=min_size)
-    return arrc
-
-def approx_area_m2(geom, crs):
-    """If CRS is geographic (EPSG:4326) approximate area using local meters per deg"""
-    area = geom.area
-    if crs and '4326' in str(crs):
-        lon, lat = geom.representative_point().x, geom.representative_point().y
-        meters_per_deg = 111320 * np.cos(np.deg2rad(lat))
-        return area * (meters_per_deg**2)
-    return area
-
-# ---------------------------
-# Read Sentinel TIFF and compute indices
-# ---------------------------
-if not os.path.exists(SENTINEL):
-    raise FileNotFoundError(f"Sentinel TIFF not found: {SENTINEL}\nPlace your multiband TIFF into PROJECT/data/raw/")
-
-print("Opening sentinel:", SENTINEL)
-with rasterio.open(SENTINEL) as src:
-    meta = src.meta.copy()
-    transform = src.transform
-    crs = src.crs
-    h, w = src.height, src.width
-    count = src.count
-    print(f"Raster size: {w} x {h}, bands: {count}, crs: {crs}")
-
-    # Expect band order: B2,B3,B4,B8,B11,B12, (optional SCL as next band)
-    if count < 6:
-        raise ValueError("Expected >=6 bands (B2,B3,B4,B8,B11,B12). Found: {}".format(count))
-
-    b2 = src.read(1).astype('float32')
-    b3 = src.read(2).astype('float32')
-    b4 = src.read(3).astype('float32')
-    b8 = src.read(4).astype('float32')
-    b11 = src.read(5).astype('float32')
-    b12 = src.read(6).astype('float32') if count >= 6 else np.zeros((h,w), dtype='float32')
-    scl = src.read(7).astype('int16') if count >= 7 else None
-
-# autoscale
-b2 = autoscale(b2); b3 = autoscale(b3); b4 = autoscale(b4); b8 = autoscale(b8); b11 = autoscale(b11); b12 = autoscale(b12)
-
-# compute indices
-ndvi = (b8 - b4) / (b8 + b4 + 1e-8)
-ndwi = (b3 - b8) / (b3 + b8 + 1e-8)
-ndbi = (b11 - b8) / (b11 + b8 + 1e-8)
-
-# valid mask (avoid zeros / nans)
-valid = np.isfinite(b2) & np.isfinite(b3) & np.isfinite(b4) & np.isfinite(b8)
-valid &= ((b2 != 0) | (b3 != 0) | (b4 != 0))
-
-# initial masks
-water_mask = np.zeros((h,w), dtype=bool)
-veg_mask = np.zeros((h,w), dtype=bool)
-bare_mask = np.zeros((h,w), dtype=bool)
-
-if scl is not None:
-    # SCL codes common mapping: 6=water, 4=vegetation, 5=not-vegetated
-    water_mask |= (scl == 6)
-    veg_mask |= (scl == 4)
-    bare_mask |= (scl == 5)
-    print("SCL present: water pixels:", int(water_mask.sum()), "veg pixels:", int(veg_mask.sum()))
-
-# index-based masks (complement SCL)
-veg_mask |= (ndvi >= NDVI_VEG_TH) & valid
-bare_mask |= (ndvi < NDVI_BARE_TH) & valid
-urban_mask = (ndbi > NDBI_URBAN_TH) & (ndvi < 0.25) & valid
-water_mask |= ((ndwi > WATER_NDWI_TH) & (ndbi < WATER_NDBI_TH) & valid)
-
-# remove cloud/shadow if SCL exists
-if scl is not None:
-    cloud_codes = [3,8,9,10]  # cloud-shadow and cloud
-    mask_cloud = np.isin(scl, cloud_codes)
-    veg_mask &= ~mask_cloud
-    urban_mask &= ~mask_cloud
-    bare_mask &= ~mask_cloud
-    water_mask &= ~mask_cloud
-
-# combine with priority: water > urban > veg > bare
-label = np.zeros((h,w), dtype='uint8')
-label[water_mask] = 1
-label[(label==0) & urban_mask] = 2
-label[(label==0) & veg_mask] = 3
-label[(label==0) & bare_mask] = 4
-
-print("Raw label counts:", {i:int((label==i).sum()) for i in [1,2,3,4]})
-
-# optional: use OSM rivers to force water (if available)
-if os.path.exists(OSM_RIVERS):
-    print("Applying OSM rivers (found):", OSM_RIVERS)
-    try:
-        rivers = gpd.read_file(OSM_RIVERS)
-        if rivers.crs is None:
-            rivers.set_crs(crs, inplace=True)
-        # rasterize rivers (all_touched True to cover line width)
-        shapes_riv = ((geom, 1) for geom in rivers.geometry)
-        riv_arr = rasterize(shapes_riv, out_shape=(h,w), transform=transform, fill=0, all_touched=True, dtype='uint8')
-        label[riv_arr==1] = 1
-        print("Applied rivers mask -> water forced.")
-    except Exception as e:
-        print("OSM rivers rasterize error:", e)
-
-# cleaning: morphology and remove small objects per-class
-lab_clean = np.zeros_like(label)
-for cls in [1,2,3,4]:
-    m = (label == cls)
-    if not np.any(m):
-        continue
-    mc = clean_bool(m, morph_radius=MORPH_RADIUS, min_size=SMALL_OBJ_PIXELS)
-    lab_clean[mc] = cls
-
-# fallback: keep original label where cleaning removed everything
-lab_clean[lab_clean==0] = label[lab_clean==0]
-
-print("After cleaning counts:", {i:int((lab_clean==i).sum()) for i in [1,2,3,4]})
-
-# polygonize shapes (only keep shapes>MIN_AREA_M2)
-pixel_area = abs(transform.a * transform.e)  # pixel width * pixel height (may be degrees or meters)
-print("Pixel area (raw transform units^2):", pixel_area)
-
-polys = []
-count_all = 0
-for geom, val in shapes(lab_clean, mask=lab_clean>0, transform=transform):
-    count_all += 1
-    geom_shape = shape(geom)
-    area_m2 = approx_area_m2(geom_shape, crs)
-    if area_m2 >= MIN_AREA_M2:
-        polys.append({"geometry": geom_shape, "class": int(val), "area_m2": float(area_m2)})
-
-print("Polygons produced (after area filter):", len(polys), "from raw shapes:", count_all)
-
-if len(polys) == 0:
-    # Try relaxed filter once
-    print("No polygons survived. Relaxing MIN_AREA_M2 and SMALL_OBJ_PIXELS and re-run quick poly.")
-    polys = []
-    for geom, val in shapes(lab_clean, mask=lab_clean>0, transform=transform):
-        geom_shape = shape(geom)
-        area_m2 = approx_area_m2(geom_shape, crs)
-        # accept anything > 200 m^2
-        if area_m2 >= 200:
-            polys.append({"geometry": geom_shape, "class": int(val), "area_m2": float(area_m2)})
-    print("Relaxed-run polygons:", len(polys))
-    if len(polys) == 0:
-        raise RuntimeError("No polygons generated even after relaxation. Check input TIFF and parameters.")
-
-gdf = gpd.GeoDataFrame(polys, crs=crs)
-gdf['geometry'] = gdf.geometry.buffer(0)  # fix invalids if any
-
-# Save GeoJSON
-gdf.to_file(OUT_GEOJSON, driver='GeoJSON')
-print("Saved training polygons:", OUT_GEOJSON)
-print("Class counts (output):", gdf['class'].value_counts().to_dict())
-
-# Quick preview: RGB + boundaries
-try:
-    # create quick normalized RGB for display
-    rgb = np.dstack([np.clip(b4,0,1), np.clip(b3,0,1), np.clip(b2,0,1)])
-    fig, ax = plt.subplots(1,1, figsize=(9,9))
-    ax.imshow(rgb, origin='upper')
-except Exception:
-    fig, ax = plt.subplots(1,1, figsize=(9,9))
-    ax.imshow(ndvi, cmap='RdYlGn', origin='upper')
-
-# color mapping
-color_map = {1:'#2b83ba', 2:'#d7191c', 3:'#1a9850', 4:'#fdae61'}
-for cls, grp in gdf.groupby('class'):
+    kernel = structuring_element(morph_radius)
+    arr_u8 = np.ascontiguousarray(arr_bool).view(np.uint8)
+    arrc = cv2.morphologyEx(arr_u8, cv2.MORPH_CLOSE, kernel, borderType=cv2.BORDER_REFLECT)
+    # drop 8-connected components smaller than min_size (label 0 is background)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(arrc, connectivity=8, ltype=cv2.CV_32S)
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_size
+    keep[0] = False
+    return keep[labels]
+
+def label_windows(src, min_rows=MIN_TILE_ROWS):
+    """Windows to label tile by tile: the raster's own blocks, or, when blocks are only a few
+    rows high (striped GeoTIFF), full-width bands of >= min_rows rows so each tile is worth
+    the reads and gives the parallel kernel enough rows"""
+    blk_h, _ = src.block_shapes[0]
+    if blk_h >= min_rows:
+        return [window for _, window in src.block_windows(1)]
+    step = -(-min_rows // blk_h) * blk_h  # whole number of strips
+    return [Window(0, r, src.width, min(step, src.height - r)) for r in range(0, src.height, step)]
+
+def class_counts(lab, classes=(1,2,3,4)):
+    """Pixel count per class from a single bincount pass over the uint8 label image"""
+    counts = np.bincount(lab.ravel(), minlength=256)
+    return {cls: int(counts[cls]) for cls in classes}
+
+def polygonize_class(mask_u8, transform):
+    """Polygonize one class mask into shapely geometries; runs in a worker process.
+    Each GeoJSON dict from shapes() is converted as it streams out, so no dict list is kept.
+    Default 4-connectivity: 8-connected rings touch themselves at diagonal corners (invalid)."""
+    return [shape(geom) for geom, _ in shapes(mask_u8, mask=mask_u8.view(bool), transform=transform)]
+
+def polygonize(lab, transform, crs, classes=(1,2,3,4)):
+    """Polygonize each class of lab, in parallel processes when there are CPUs to spare;
+    returns a GeoDataFrame with a 'class' column"""
+    n_workers = min(len(classes), os.cpu_count() or 1)
+    if n_workers <= 1:
+        # no parallelism to gain: skip process start-up and pickling a full HxW mask per class
+        parts = [polygonize_class((lab == cls).view(np.uint8), transform) for cls in classes]
+    else:
+        # spawn, not fork: the parallel label kernels have already started numba's threading pool,
+        # and forked children of a TBB pool hang the parent at interpreter shutdown
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(polygonize_class, (lab == cls).view(np.uint8), transform) for cls in classes]
+            parts = [fut.result() for fut in futures]
+    geoms = [geom for part in parts for geom in part]
+    cls_col = np.repeat(np.asarray(classes, dtype='int64'), [len(part) for part in parts])
+    return gpd.GeoDataFrame({"class": cls_col}, geometry=geoms, crs=crs)
+
+def main():
+    """Build labels from the Sentinel TIFF, polygonize them and write GeoJSON + preview"""
+    # ---------------------------
+    # Ensure folders exist
+    # ---------------------------
+    for p in [os.path.join(PROJECT, "data", "training"), os.path.join(PROJECT, "outputs", "maps")]:
+        os.makedirs(p, exist_ok=True)
+
+    # ---------------------------
+    # Read Sentinel TIFF and label it tile by tile
+    # ---------------------------
+    if not os.path.exists(SENTINEL):
+        raise FileNotFoundError(f"Sentinel TIFF not found: {SENTINEL}\nPlace your multiband TIFF into PROJECT/data/raw/")
+
+    print("Opening sentinel:", SENTINEL)
+    with rasterio.open(SENTINEL) as src:
+        meta = src.meta.copy()
+        transform = src.transform
+        crs = src.crs
+        h, w = src.height, src.width
+        count = src.count
+        print(f"Raster size: {w} x {h}, bands: {count}, crs: {crs}")
+
+        # Expect band order: B2,B3,B4,B8,B11,B12, (optional SCL as next band)
+        if count < 6:
+            raise ValueError("Expected >=6 bands (B2,B3,B4,B8,B11,B12). Found: {}".format(count))
+        has_scl = count >= 7
+
+        # ~2000 px on the long side: plenty for a 9in/180dpi preview and for the scale test
+        ds = max(1, max(h, w) // 2000)
+        small_shape = (max(1, h // ds), max(1, w // ds))
+
+        # per-band 0..10000 test (as before), on a decimated read instead of a full pass
+        band_max = {k: np.nanmax(src.read(k, out_shape=small_shape, out_dtype='float32'))
+                    for k in (1, 2, 3, 4, 5)}
+
+        # downsampled RGB (B4,B3,B2) for the preview
+        rgb_small = src.read([3, 2, 1], out_shape=(3,) + small_shape,
+                             out_dtype='float32', resampling=Resampling.average)
+        for c, k in enumerate((3, 2, 1)):
+            autoscale(rgb_small[c], band_max[k])
+
+        # nodata (0 if unset) scaled exactly like B2,B3,B4; NaN/Inf only need checking on float rasters
+        nodata = src.nodatavals[0]
+        if nodata is None or np.isnan(nodata):
+            nodata = 0
+        nodata = np.array([autoscale(np.array([nodata], dtype='float32'), band_max[k])[0] for k in (1, 2, 3)],
+                          dtype='float32')
+        check_finite = np.dtype(src.dtypes[0]).kind == 'f'
+
+        # one uint8 label mosaic; float bands only ever exist for the current tile
+        label = np.zeros((h,w), dtype='uint8')
+        scl_hist = np.zeros(256, dtype='int64')
+        # float32 read buffers for B2,B3,B4,B8,B11, sized for the largest tile and reused for every tile
+        windows = label_windows(src)
+        band_bufs = np.empty((5, max(int(win.height) * int(win.width) for win in windows)), dtype='float32')
+
+        for window in windows:
+            th, tw = int(window.height), int(window.width)
+            # GDAL casts to float32 while reading, straight into the buffers
+            b2, b3, b4, b8, b11 = (
+                autoscale(src.read(k, window=window, out=buf[:th * tw].reshape(th, tw)), band_max[k])
+                for k, buf in zip((1, 2, 3, 4, 5), band_bufs)
+            )
+
+            # indices, masks and priority (water > urban > veg > bare) in one pass per tile
+            tile = label[window.toslices()]
+            if has_scl:
+                # SCL codes are 0..11, so uint8 is lossless and indexes SCL_LUT directly
+                scl = src.read(7, window=window, out_dtype='uint8')
+                scl_hist += np.bincount(scl.ravel(), minlength=256)
+                label_tile_scl(b2, b3, b4, b8, b11, scl, nodata, check_finite, tile)
+            else:
+                label_tile(b2, b3, b4, b8, b11, nodata, check_finite, tile)
+
+    if has_scl:
+        print("SCL present: water pixels:", int(scl_hist[6]), "veg pixels:", int(scl_hist[4]))
+
+    print("Raw label counts:", class_counts(label))
+
+    # optional: use OSM rivers to force water (if available)
+    if os.path.exists(OSM_RIVERS):
+        print("Applying OSM rivers (found):", OSM_RIVERS)
+        try:
+            rivers = gpd.read_file(OSM_RIVERS)
+            if rivers.crs is None:
+                rivers.set_crs(crs, inplace=True)
+            # burn rivers as water straight into label (all_touched True to cover line width)
+            shapes_riv = ((geom, 1) for geom in rivers.geometry)
+            rasterize(shapes_riv, out=label, transform=transform, all_touched=True,
+                      default_value=1, merge_alg=MergeAlg.replace)
+            print("Applied rivers mask -> water forced.")
+        except Exception as e:
+            print("OSM rivers rasterize error:", e)
+
+    # cleaning: morphology and remove small objects per-class
+    # (one bincount tells which classes exist, so absent ones are never scanned or cleaned)
+    # cleaned classes are written over a copy of label, so pixels no cleaned mask covers
+    # keep their original label without a separate fallback pass
+    present = [cls for cls, n in class_counts(label).items() if n > 0]
+    lab_clean = label.copy()
+    for cls in present:
+        m = (label == cls)
+        mc = clean_bool(m, morph_radius=MORPH_RADIUS, min_size=SMALL_OBJ_PIXELS)
+        lab_clean[mc] = cls
+
+    clean_counts = class_counts(lab_clean)
+    print("After cleaning counts:", clean_counts)
+
+    # polygonize shapes (only keep shapes>MIN_AREA_M2)
+    pixel_area = abs(transform.a * transform.e)  # pixel width * pixel height (may be degrees or meters)
+    print("Pixel area (raw transform units^2):", pixel_area)
+
+    gdf = polygonize(lab_clean, transform, crs, classes=[cls for cls, n in clean_counts.items() if n > 0])
+    # one reprojection to an equal-area CRS gives true m^2 for geographic and projected inputs alike
+    gdf['area_m2'] = gdf.to_crs(AREA_CRS).area if crs is not None else gdf.area
+    areas = gdf['area_m2'].to_numpy()
+    keep = areas >= MIN_AREA_M2
+
+    print("Polygons produced (after area filter):", int(keep.sum()), "from raw shapes:", len(gdf))
+
+    if not keep.any():
+        # Try relaxed filter once: polygons and their areas are already computed,
+        # so relaxing is just a new mask over the cached areas (no re-polygonize)
+        print(f"No polygons survived. Relaxing MIN_AREA_M2 to {RELAXED_MIN_AREA_M2} on the cached polygons.")
+        keep = areas >= RELAXED_MIN_AREA_M2
+        print("Relaxed-run polygons:", int(keep.sum()))
+        if not keep.any():
+            raise RuntimeError("No polygons generated even after relaxation. Check input TIFF and parameters.")
+
+    gdf = gdf[keep].reset_index(drop=True)
+    # 4-connected shapes() output is normally valid; MakeValid returns valid geometries
+    # unchanged and only repairs the rare invalid ring
+    gdf['geometry'] = gdf.geometry.make_valid()
+    gdf = gdf[~gdf.is_empty]
+
+    # Save GeoJSON
+    gdf.to_file(OUT_GEOJSON, driver='GeoJSON', engine='pyogrio')
+    print("Saved training polygons:", OUT_GEOJSON)
+    print("Class counts (output):", gdf['class'].value_counts().to_dict())
+
+    # Quick preview: RGB + boundaries
+    west, south, east, north = array_bounds(h, w, transform)
+    extent = (west, east, south, north)  # draw in map units so the polygon boundaries line up
     try:
-        grp.boundary.plot(ax=ax, edgecolor=color_map.get(cls,'k'), linewidth=1, label=f'{cls} ({len(grp)})')
+        # create quick normalized RGB for display (from the downsampled read)
+        rgb = np.clip(rgb_small, 0, 1).transpose(1, 2, 0)
+        fig, ax = plt.subplots(1,1, figsize=(9,9))
+        ax.imshow(rgb, origin='upper', extent=extent)
     except Exception:
-        pass
-
-ax.legend()
-ax.axis('off')
-ax.set_title("Auto training polygons preview")
-plt.savefig(PREVIEW_PNG, dpi=180, bbox_inches='tight')
-plt.show()
-print("Preview saved to:", PREVIEW_PNG)
-
-# Final short QA output
-print("\n--- Quick QA ---")
-print("PROJECT:", PROJECT)
-print("SENTINEL:", SENTINEL)
-print("OUTPUT GEOJSON:", OUT_GEOJSON)
-print("PREVIEW PNG:", PREVIEW_PNG)
-print("Number polygons:", len(gdf))
-print("Classes:", gdf['class'].value_counts().to_dict())
+        fig, ax = plt.subplots(1,1, figsize=(9,9))
+        ax.imshow(label, cmap='tab10', origin='upper', extent=extent)
+
+    # color mapping
+    color_map = {1:'#2b83ba', 2:'#d7191c', 3:'#1a9850', 4:'#fdae61'}
+    for cls, grp in gdf.groupby('class'):
+        try:
+            grp.boundary.plot(ax=ax, edgecolor=color_map.get(cls,'k'), linewidth=1, label=f'{cls} ({len(grp)})')
+        except Exception:
+            pass
+
+    ax.legend()
+    ax.axis('off')
+    ax.set_title("Auto training polygons preview")
+    plt.savefig(PREVIEW_PNG, dpi=180, bbox_inches='tight')
+    plt.show()
+    print("Preview saved to:", PREVIEW_PNG)
+
+    # Final short QA output
+    print("\n--- Quick QA ---")
+    print("PROJECT:", PROJECT)
+    print("SENTINEL:", SENTINEL)
+    print("OUTPUT GEOJSON:", OUT_GEOJSON)
+    print("PREVIEW PNG:", PREVIEW_PNG)
+    print("Number polygons:", len(gdf))
+    print("Classes:", gdf['class'].value_counts().to_dict())
+
+
+if __name__ == "__main__":
+    main()